@@ -0,0 +1,190 @@
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import traceback
+import tracemalloc
+
+# Run without a display (must be set before Qt is imported)
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PySide6 import QtCore, QtWidgets
+
+import main
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Repeat ReciPython page reloads and check for memory or "
+                                                 "widget leaks.")
+    parser.add_argument('--cycles', type=int, default=1000, help="number of reload cycles to run")
+    parser.add_argument('--warmup', type=int, default=20, help="cycles to run before taking the baseline")
+    parser.add_argument('--favourites', type=int, default=200, help="favourites to seed the database with")
+    parser.add_argument('--history', type=int, default=20, help="search history entries to seed the database with")
+    parser.add_argument('--results', type=int, default=50, help="recipes shown on the search page each cycle")
+    parser.add_argument('--max-widget-growth', type=int, default=0, help="allowed growth in live QWidgets")
+    parser.add_argument('--max-python-growth', type=int, default=2048, help="allowed growth in traced Python KB")
+    parser.add_argument('--max-object-growth', type=int, default=1000,
+                        help="allowed growth in Python objects tracked by the garbage collector")
+    parser.add_argument('--max-rss-growth', type=int, default=32 * 1024, help="allowed growth in RSS KB")
+    parser.add_argument('--output', help="CSV file to write per-cycle measurements to")
+    return parser.parse_args()
+
+
+# Build a recipe in the shape returned by informationBulk
+def make_recipe_info(recipe_id):
+    return {
+        'id': recipe_id,
+        'title': f"Recipe {recipe_id}",
+        'sourceName': "Harness",
+        'readyInMinutes': 30,
+        'servings': 4,
+        'sourceUrl': f"https://example.com/recipes/{recipe_id}",
+        'extendedIngredients': [{'nameClean': f"ingredient {(recipe_id + i) % 100}"} for i in range(8)],
+        'nutrition': {'nutrients': [
+            {'name': 'Calories', 'amount': 400 + recipe_id % 200},
+            {'name': 'Fat', 'amount': 10 + recipe_id % 20},
+            {'name': 'Carbohydrates', 'amount': 40 + recipe_id % 30},
+            {'name': 'Protein', 'amount': 20 + recipe_id % 15}
+        ]}
+    }
+
+
+def favourite_row(index):
+    return (f"Favourite {index}", "Harness", "30", "4", "500kcal", "20g", "50g", "25g",
+            f"https://example.com/favourites/{index}")
+
+
+def seed_database(window, args, recipes_info):
+    cursor = window.conn.cursor()
+
+    # Seed favourites and search history
+    cursor.executemany("""
+        INSERT INTO favourites (name, source, ready_in_minutes, servings, calories, fat, carbs, protein, url)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [favourite_row(i) for i in range(args.favourites)])
+    result_ids = ','.join(str(recipe['id']) for recipe in recipes_info)
+    cursor.executemany("""
+        INSERT INTO search_history (ingredients, filters, result_ids)
+        VALUES (?, ?, ?)
+    """, [(f"ingredient {i}, ingredient {i + 1}", "lunch,dinner", result_ids) for i in range(args.history)])
+    window.conn.commit()
+
+    # Seed stored recipes used by the search page
+    window.save_recipes([main.parse_recipe_info(recipe) for recipe in recipes_info])
+
+
+def run_cycle(window, recipes_info):
+    cursor = window.conn.cursor()
+
+    # Reload each page the way the user would
+    window.favourites_page.load_favourites()
+    window.history_page.load_search_history()
+    window.search_page.update_results(recipes_info)
+
+    # Remove a favourite and a search, then put them back so the database size stays the same
+    cursor.execute("SELECT * FROM favourites ORDER BY id LIMIT 1")
+    favourite = cursor.fetchone()
+    if favourite:
+        window.favourites_page.remove_from_favourites(favourite)
+        cursor.execute("""
+            INSERT INTO favourites (name, source, ready_in_minutes, servings, calories, fat, carbs, protein, url)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, favourite[1:])
+
+    cursor.execute("SELECT id, ingredients, filters, timestamp, result_ids FROM search_history ORDER BY id LIMIT 1")
+    entry = cursor.fetchone()
+    if entry:
+        window.history_page.delete_search(entry)
+        cursor.execute("""
+            INSERT INTO search_history (ingredients, filters, result_ids)
+            VALUES (?, ?, ?)
+        """, (entry[1], entry[2], entry[4]))
+    window.conn.commit()
+
+
+def measure(cycle):
+    return {
+        'cycle': cycle,
+        'widgets': len(QtWidgets.QApplication.allWidgets()),
+        'python_kb': tracemalloc.get_traced_memory()[0] // 1024,
+        'objects': len(gc.get_objects()),
+        'rss_kb': main.current_rss() // 1024
+    }
+
+
+def main_harness():
+    args = parse_args()
+    app = QtWidgets.QApplication(sys.argv)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        window = main.MainWindow(os.path.join(temp_dir, 'recipython.db'))
+        recipes_info = [make_recipe_info(recipe_id) for recipe_id in range(1, args.results + 1)]
+        seed_database(window, args, recipes_info)
+
+        measurements = []
+
+        # Run one cycle per event loop iteration so deleteLater is handled exactly as in the app
+        def next_cycle(cycle=0):
+            try:
+                # Once warmed up, measure after each cycle's deferred deletes have been processed
+                if cycle >= args.warmup:
+                    gc.collect()
+                    measurement = measure(cycle - args.warmup)
+                    measurements.append(measurement)
+                    if measurement['cycle'] and measurement['cycle'] % 100 == 0:
+                        print(f"Cycle {measurement['cycle']}: {measurement['widgets']} widgets, "
+                              f"{measurement['python_kb']}KB Python, {measurement['objects']} objects, "
+                              f"{measurement['rss_kb']}KB RSS")
+
+                if cycle == args.warmup + args.cycles:
+                    app.quit()
+                    return
+
+                run_cycle(window, recipes_info)
+            except Exception:
+                traceback.print_exc()
+                app.exit(1)
+                return
+
+            QtCore.QTimer.singleShot(0, lambda: next_cycle(cycle + 1))
+
+        # Trace from the start so the baseline includes the cards that stay alive between reloads
+        tracemalloc.start()
+        QtCore.QTimer.singleShot(0, next_cycle)
+        exit_code = app.exec()
+        tracemalloc.stop()
+        window.conn.close()
+
+    if exit_code:
+        print("FAIL: error during reload cycles")
+        return exit_code
+
+    # Write per-cycle measurements if requested
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write("cycle,widgets,python_kb,objects,rss_kb\n")
+            for measurement in measurements:
+                output.write(f"{measurement['cycle']},{measurement['widgets']},{measurement['python_kb']},"
+                             f"{measurement['objects']},{measurement['rss_kb']}\n")
+
+    # Compare final measurements against the baseline
+    baseline = measurements[0]
+    final = measurements[-1]
+    failures = []
+    for key, limit in (('widgets', args.max_widget_growth), ('python_kb', args.max_python_growth),
+                       ('objects', args.max_object_growth), ('rss_kb', args.max_rss_growth)):
+        growth = final[key] - baseline[key]
+        print(f"{key}: {baseline[key]} -> {final[key]} (growth {growth}, limit {limit})")
+        if growth > limit:
+            failures.append(key)
+
+    if failures:
+        print(f"FAIL: growth over threshold for {', '.join(failures)}")
+        return 1
+    print("PASS")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_harness())
@@ -1,13 +1,29 @@
+import hashlib
+import heapq
+import json
+import math
 import os
+import re
 import sqlite3
 import sys
+import zlib
 import requests as req
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv, set_key
 from PySide6 import QtWidgets
 
 # Constants
 MIN_CARD_HEIGHT = 250
 MIN_CARD_WIDTH = 425
+SIMILAR_RECIPES_COUNT = 5
+SIMILAR_INGREDIENT_WEIGHT = 0.8
+SIMILAR_NUTRITION_WEIGHT = 0.2
+SIMILAR_CANDIDATE_INGREDIENTS = 3  # Most distinctive ingredients used to gather candidates
+COMMON_INGREDIENT_RATIO = 0.05
+DICTIONARY_TRAINING_SAMPLES = 100
+DICTIONARY_MAX_SIZE = 32 * 1024  # zlib only uses the last 32KB of a preset dictionary
+INSTRUMENT_RELOADS = os.getenv('RECIPYTHON_INSTRUMENT') == '1'
+NO_RESULTS = 'none'  # Stored as result ids for searches that found no recipes
 
 
 class FilterDropdown(QtWidgets.QPushButton):
@@ -99,8 +115,398 @@ class StackedWidget(QtWidgets.QStackedWidget):
         self.parentWidget().adjustSize()
 
 
-class MainWindow(QtWidgets.QMainWindow):
+class RecipeIndex:
     def __init__(self):
+        # Sparse ingredient matrix (recipe id -> ingredients) and inverted index (ingredient -> recipe ids)
+        self.recipe_ingredients = {}
+        self.ingredient_recipes = {}
+
+        # Precomputed TF-IDF vector norms (recipe id -> norm), kept up to date as recipes are added
+        self.recipe_norms = {}
+
+        # Normalized macro vectors (recipe id -> unit vector of fat, carbs and protein energy)
+        self.macro_vectors = {}
+
+    def __len__(self):
+        return len(self.recipe_ingredients)
+
+    def add_recipe(self, recipe_id, ingredients, fat, carbs, protein):
+        self._insert_recipe(recipe_id, ingredients, fat, carbs, protein)
+        self.recipe_norms[recipe_id] = self.norm(self.recipe_ingredients[recipe_id])
+
+    def add_recipes(self, recipes):
+        # Bulk load (recipe id, ingredients, fat, carbs, protein) rows, computing every norm once at the end
+        for recipe in recipes:
+            self._insert_recipe(*recipe)
+        self.refresh_norms()
+
+    def _insert_recipe(self, recipe_id, ingredients, fat, carbs, protein):
+        # Remove previous version of the recipe so updates don't double count ingredients
+        self.remove_recipe(recipe_id)
+
+        ingredients = {ingredient.strip().lower() for ingredient in ingredients if ingredient.strip()}
+        self.recipe_ingredients[recipe_id] = ingredients
+        for ingredient in ingredients:
+            self.ingredient_recipes.setdefault(ingredient, set()).add(recipe_id)
+
+        # Convert macros to energy so the profile reflects what the recipe is made of, not its size
+        macro_vector = (_to_float(fat) * 9, _to_float(carbs) * 4, _to_float(protein) * 4)
+        length = math.sqrt(sum(value * value for value in macro_vector))
+        self.macro_vectors[recipe_id] = tuple(value / length for value in macro_vector) if length else None
+
+    def remove_recipe(self, recipe_id):
+        ingredients = self.recipe_ingredients.pop(recipe_id, None)
+        if ingredients is None:
+            return
+
+        for ingredient in ingredients:
+            recipe_ids = self.ingredient_recipes.get(ingredient)
+            if recipe_ids is not None:
+                recipe_ids.discard(recipe_id)
+                if not recipe_ids:
+                    del self.ingredient_recipes[ingredient]
+        self.recipe_norms.pop(recipe_id, None)
+        self.macro_vectors.pop(recipe_id, None)
+
+    def idf(self, ingredient):
+        # Smoothed inverse document frequency
+        document_count = len(self.ingredient_recipes.get(ingredient, ()))
+        return math.log((len(self.recipe_ingredients) + 1) / (document_count + 1)) + 1
+
+    def norm(self, ingredients):
+        return math.sqrt(sum(self.idf(ingredient) ** 2 for ingredient in ingredients))
+
+    def refresh_norms(self):
+        # Recompute all norms with the current corpus weights (adding a recipe only computes its own norm, so
+        # the others drift slightly as document counts change until the next refresh)
+        weights = {ingredient: self.idf(ingredient) ** 2 for ingredient in self.ingredient_recipes}
+        self.recipe_norms = {recipe_id: math.sqrt(sum(map(weights.__getitem__, ingredients)))
+                             for recipe_id, ingredients in self.recipe_ingredients.items()}
+
+    def similar(self, recipe_id, count=SIMILAR_RECIPES_COUNT):
+        ingredients = self.recipe_ingredients.get(recipe_id)
+        if not ingredients:
+            return []
+
+        weights = {ingredient: self.idf(ingredient) ** 2 for ingredient in ingredients}
+
+        # Gather candidates through the few most distinctive ingredients only (onion, salt, etc. match a large
+        # share of recipes), continuing through more common ones while fewer than count candidates were found
+        common_limit = len(self.recipe_ingredients) * COMMON_INGREDIENT_RATIO
+        by_rarity = sorted(ingredients, key=lambda ingredient: (len(self.ingredient_recipes[ingredient]), ingredient))
+        dot_products = {}
+        gathered = 0
+        for ingredient in by_rarity:
+            candidate_ids = self.ingredient_recipes[ingredient]
+            if (gathered >= SIMILAR_CANDIDATE_INGREDIENTS or len(candidate_ids) > common_limit) and \
+                    len(dot_products) > count:
+                # Only add this ingredient's weight to candidates that were already gathered
+                candidate_ids = candidate_ids.intersection(dot_products)
+            else:
+                gathered += 1
+
+            # Accumulate shared ingredient weights (dot product of TF-IDF vectors) per candidate
+            weight = weights[ingredient]
+            for candidate_id in candidate_ids:
+                dot_products[candidate_id] = dot_products.get(candidate_id, 0) + weight
+        dot_products.pop(recipe_id, None)
+
+        # Combine ingredient cosine similarity with nutrition profile similarity
+        recipe_norm = self.recipe_norms[recipe_id]
+        recipe_norms = self.recipe_norms
+        macro_vector = self.macro_vectors.get(recipe_id)
+        macro_vectors = self.macro_vectors
+        scores = []
+        for candidate_id, dot_product in dot_products.items():
+            score = SIMILAR_INGREDIENT_WEIGHT * dot_product / (recipe_norm * recipe_norms[candidate_id])
+            candidate_macro_vector = macro_vectors[candidate_id]
+            if macro_vector and candidate_macro_vector:
+                fat, carbs, protein = candidate_macro_vector
+                score += SIMILAR_NUTRITION_WEIGHT * (macro_vector[0] * fat + macro_vector[1] * carbs +
+                                                     macro_vector[2] * protein)
+            scores.append((score, -candidate_id))
+
+        return [-negated_id for _, negated_id in heapq.nlargest(count, scores)]
+
+
+# Build the similarity index from the recipes stored in the database (runs on its own connection so it can be
+# called from a background thread)
+def load_recipe_index(db_path):
+    recipe_index = RecipeIndex()
+    try:
+        conn = sqlite3.connect(db_path)
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, ingredients, fat_amount, carbs_amount, protein_amount FROM recipes")
+            recipe_index.add_recipes((recipe_id, ingredients.split(','), fat, carbs, protein)
+                                     for recipe_id, ingredients, fat, carbs, protein in cursor)
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"Error loading recipe index: {e}")
+    return recipe_index
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# Merge findByIngredients results from several queries, deduplicated by recipe id and ranked by combined score
+def merge_recipe_results(results):
+    scores = {}
+    for recipes in results:
+        for recipe in recipes:
+            # Score by share of the recipe's ingredients that were searched for
+            used = recipe.get('usedIngredientCount', 0)
+            missed = recipe.get('missedIngredientCount', 0)
+            match_score = used / (used + missed) if used + missed else 0
+
+            # Keep the best match score and likes, and count how many queries found the recipe
+            best_score, query_count, likes = scores.get(recipe['id'], (0, 0, 0))
+            scores[recipe['id']] = (max(best_score, match_score), query_count + 1, max(likes, recipe.get('likes', 0)))
+
+    # Rank by match score, then by how many queries found the recipe, then by likes
+    return sorted(scores, key=lambda recipe_id: tuple(-value for value in scores[recipe_id]))
+
+
+# Extract the recipe data shown on cards and used for similarity search from an informationBulk recipe
+def parse_recipe_info(recipe):
+    # Extract basic recipe info
+    name = recipe.get('title', 'No title')
+    source = recipe.get('sourceName', 'No source')
+    ready_in_minutes = recipe.get('readyInMinutes', 'Unknown ready time')
+    servings = recipe.get('servings', 'Unknown servings')
+    url = recipe.get('sourceUrl', '#')
+
+    # Extract ingredient names
+    ingredients = [ingredient.get('nameClean') or ingredient.get('name', '')
+                   for ingredient in recipe.get('extendedIngredients', [])]
+    ingredients = sorted({ingredient.strip().lower().replace(',', ' ') for ingredient in ingredients
+                          if ingredient and ingredient.strip()})
+
+    # Extract from nutrition info to get calories, fat, carbs, and protein
+    nutrition_info = {nutrient['name']: nutrient['amount'] for nutrient in
+                      (recipe.get('nutrition') or {}).get('nutrients', [])}
+    calories = nutrition_info.get('Calories', '')
+    fat = nutrition_info.get('Fat', '')
+    carbs = nutrition_info.get('Carbohydrates', '')
+    protein = nutrition_info.get('Protein', '')
+
+    # Create a dictionary to hold recipe data, adding units to the values if they exist else making them a ?
+    return {
+        'id': recipe.get('id'),
+        'name': name,
+        'source': source,
+        'ready_in_minutes': ready_in_minutes,
+        'servings': servings,
+        'calories': f"{calories}kcal" if calories else '?',
+        'fat': f"{fat}g" if fat else '?',
+        'carbs': f"{carbs}g" if carbs else '?',
+        'protein': f"{protein}g" if protein else '?',
+        'url': url,
+        'ingredients': ingredients,
+        'fat_amount': _to_float(fat),
+        'carbs_amount': _to_float(carbs),
+        'protein_amount': _to_float(protein)
+    }
+
+
+class LazyPayload:
+    def __init__(self, data, dictionary):
+        # Keep payload compressed until it is accessed
+        self.data = data
+        self.dictionary = dictionary
+        self._value = None
+
+    @property
+    def value(self):
+        if self._value is None:
+            self._value = json.loads(decompress_payload(self.data, self.dictionary))
+        return self._value
+
+
+class PayloadStore:
+    def __init__(self, conn):
+        self.conn = conn
+
+        # Cache dictionaries in memory as they are shared by most payloads
+        self.dictionaries = {}
+        self.dictionary_id = None
+        self.load_dictionaries()
+
+    def load_dictionaries(self):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT id, data FROM payload_dictionaries ORDER BY id")
+        self.dictionaries = dict(cursor.fetchall())
+
+        # Newest dictionary is used for new payloads
+        self.dictionary_id = max(self.dictionaries) if self.dictionaries else None
+
+    def put_recipes(self, recipes_info):
+        # Train a dictionary once enough payloads are stored to learn their shared structure
+        if self.dictionary_id is None:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM payloads")
+            if cursor.fetchone()[0] + len(recipes_info) >= DICTIONARY_TRAINING_SAMPLES:
+                self.train_dictionary([encode_payload(recipe) for recipe in recipes_info])
+
+        rows = []
+        recipe_hashes = []
+        dictionary = self.dictionaries.get(self.dictionary_id, b'')
+        for recipe in recipes_info:
+            # Key payloads by content hash so identical payloads are only stored once
+            payload = encode_payload(recipe)
+            payload_hash = hashlib.sha256(payload).hexdigest()
+            rows.append((payload_hash, self.dictionary_id, compress_payload(payload, dictionary)))
+            recipe_hashes.append((recipe.get('id'), payload_hash))
+
+        cursor = self.conn.cursor()
+        # Replace existing rows so a damaged payload is repaired when its recipe is fetched again
+        cursor.executemany("INSERT OR REPLACE INTO payloads (hash, dictionary_id, data) VALUES (?, ?, ?)", rows)
+        cursor.executemany("INSERT OR REPLACE INTO recipe_payloads (recipe_id, hash) VALUES (?, ?)", recipe_hashes)
+        self.conn.commit()
+
+    def get_recipes(self, recipe_ids):
+        cursor = self.conn.cursor()
+        cursor.execute(f"""
+            SELECT recipe_payloads.recipe_id, payloads.dictionary_id, payloads.data
+            FROM recipe_payloads
+            JOIN payloads ON payloads.hash = recipe_payloads.hash
+            WHERE recipe_payloads.recipe_id IN ({','.join('?' * len(recipe_ids))})
+        """, list(recipe_ids))
+        return {recipe_id: LazyPayload(data, self.dictionaries.get(dictionary_id, b''))
+                for recipe_id, dictionary_id, data in cursor.fetchall()}
+
+    def train_dictionary(self, samples=()):
+        # Sample stored payloads along with any new ones
+        samples = list(samples)
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT dictionary_id, data FROM payloads ORDER BY RANDOM() LIMIT ?",
+                       (DICTIONARY_TRAINING_SAMPLES,))
+        for dictionary_id, data in cursor.fetchall():
+            samples.append(decompress_payload(data, self.dictionaries.get(dictionary_id, b'')))
+
+        dictionary = build_dictionary(samples)
+        if not dictionary:
+            return
+
+        cursor.execute("INSERT INTO payload_dictionaries (data) VALUES (?)", (dictionary,))
+        self.conn.commit()
+        self.dictionaries[cursor.lastrowid] = dictionary
+        self.dictionary_id = cursor.lastrowid
+
+    def compact(self):
+        cursor = self.conn.cursor()
+        size_before = database_size(self.conn)
+
+        # Delete payloads no longer referenced by any recipe
+        cursor.execute("DELETE FROM payloads WHERE hash NOT IN (SELECT hash FROM recipe_payloads)")
+        self.conn.commit()
+
+        # Retrain the dictionary on the current payloads and recompress everything with it
+        self.train_dictionary()
+        dictionary = self.dictionaries.get(self.dictionary_id, b'')
+        cursor.execute("SELECT hash, dictionary_id, data FROM payloads")
+        rows = [(self.dictionary_id,
+                 compress_payload(decompress_payload(data, self.dictionaries.get(dictionary_id, b'')), dictionary),
+                 payload_hash)
+                for payload_hash, dictionary_id, data in cursor.fetchall() if dictionary_id != self.dictionary_id]
+        cursor.executemany("UPDATE payloads SET dictionary_id = ?, data = ? WHERE hash = ?", rows)
+
+        # Delete dictionaries no longer used
+        cursor.execute("""
+            DELETE FROM payload_dictionaries
+            WHERE id NOT IN (SELECT dictionary_id FROM payloads WHERE dictionary_id IS NOT NULL)
+        """)
+        self.conn.commit()
+        self.load_dictionaries()
+
+        # Reclaim free pages
+        self.conn.execute("VACUUM")
+        return size_before, database_size(self.conn)
+
+
+# Encode a payload as canonical JSON so equal content always has the same hash
+def encode_payload(payload):
+    return json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def compress_payload(payload, dictionary=b''):
+    compressor = zlib.compressobj(9, zdict=dictionary) if dictionary else zlib.compressobj(9)
+    return compressor.compress(payload) + compressor.flush()
+
+
+def decompress_payload(data, dictionary=b''):
+    decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+# Build a preset dictionary from the keys and values repeated across payloads
+def build_dictionary(samples):
+    # Count how many payloads each key, string value and number appears in
+    counts = {}
+    for sample in samples:
+        for fragment in set(re.findall(rb'"[^"]{1,80}":|"[^"]{1,80}"|-?\d+\.?\d*[,}\]]', sample)):
+            counts[fragment] = counts.get(fragment, 0) + 1
+
+    # Keep fragments found in several payloads, most valuable last since zlib favours closer matches
+    fragments = sorted((fragment for fragment, count in counts.items() if count > 1),
+                       key=lambda fragment: (counts[fragment] * len(fragment), fragment))
+    dictionary = b''.join(fragments)[-DICTIONARY_MAX_SIZE // 2:]
+
+    # End with a whole payload so common key sequences and nesting can be matched too
+    if samples:
+        dictionary += min(samples, key=len)[:DICTIONARY_MAX_SIZE // 2]
+    return dictionary[-DICTIONARY_MAX_SIZE:]
+
+
+# Resident set size in bytes (current on Linux, peak elsewhere as it is the best available without psutil)
+def current_rss():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return 0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+# Remove cards from a layout before deleting them, so reloads never touch cards already pending deletion
+def clear_cards(layout):
+    for i in reversed(range(layout.count())):
+        widget = layout.itemAt(i).widget()
+        if widget:
+            # removeWidget also frees the layout item holding the card
+            layout.removeWidget(widget)
+            widget.deleteLater()
+
+
+# Log live widget count and memory after a page reload when instrumentation is enabled
+def instrument_reload(label):
+    if not INSTRUMENT_RELOADS:
+        return
+    print(f"[instrument] {label}: {len(QtWidgets.QApplication.allWidgets())} live widgets, "
+          f"{current_rss() // 1024}KB RSS")
+
+
+def database_size(conn):
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA page_count")
+    page_count = cursor.fetchone()[0]
+    cursor.execute("PRAGMA page_size")
+    return page_count * cursor.fetchone()[0]
+
+
+class MainWindow(QtWidgets.QMainWindow):
+    def __init__(self, db_path='recipython.db'):
         super().__init__()
 
         self.setWindowTitle("ReciPython")
@@ -110,9 +516,19 @@ class MainWindow(QtWidgets.QMainWindow):
         self.api_key = os.getenv('API_KEY', 'API Key not set')
 
         # Initialize recipes database
-        self.conn = sqlite3.connect('recipython.db')
+        self.conn = sqlite3.connect(db_path)
         self.init_database()
 
+        # Initialize compressed archive of raw recipe payloads
+        self.payload_store = PayloadStore(self.conn)
+
+        # Similarity index over locally stored recipes, built in the background so startup isn't blocked
+        # (recipes saved before it is ready are kept and added once it is)
+        self.recipe_index = None
+        self.pending_recipes = []
+        self.index_executor = ThreadPoolExecutor(max_workers=1)
+        self.recipe_index_future = self.index_executor.submit(load_recipe_index, db_path)
+
         # Create stacked widget (holds multiple pages)
         self.stacked_widget = StackedWidget()
         self.setCentralWidget(self.stacked_widget)
@@ -156,7 +572,50 @@ class MainWindow(QtWidgets.QMainWindow):
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     ingredients TEXT,
                     filters TEXT,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    result_ids TEXT DEFAULT ''
+                )
+            """)
+
+            # Add result ids column to search history tables created before it existed
+            cursor.execute("PRAGMA table_info(search_history)")
+            if 'result_ids' not in [column[1] for column in cursor.fetchall()]:
+                cursor.execute("ALTER TABLE search_history ADD COLUMN result_ids TEXT DEFAULT ''")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS recipes (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT,
+                    source TEXT,
+                    ready_in_minutes TEXT,
+                    servings TEXT,
+                    calories TEXT,
+                    fat TEXT,
+                    carbs TEXT,
+                    protein TEXT,
+                    url TEXT,
+                    ingredients TEXT,
+                    fat_amount REAL,
+                    carbs_amount REAL,
+                    protein_amount REAL
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS payload_dictionaries (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    data BLOB
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS payloads (
+                    hash TEXT PRIMARY KEY,
+                    dictionary_id INTEGER,
+                    data BLOB
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS recipe_payloads (
+                    recipe_id INTEGER PRIMARY KEY,
+                    hash TEXT
                 )
             """)
             self.conn.commit()
@@ -172,6 +631,77 @@ class MainWindow(QtWidgets.QMainWindow):
                                            QtWidgets.QMessageBox.StandardButton.Ok)
             return
 
+    # Get the similarity index, or None if it is still being built
+    def get_recipe_index(self):
+        if self.recipe_index is None:
+            if not self.recipe_index_future.done():
+                return None
+            self.recipe_index = self.recipe_index_future.result()
+            self.index_executor.shutdown()
+
+            # Add recipes saved while the index was being built
+            self.add_to_recipe_index(self.pending_recipes)
+            self.pending_recipes = []
+        return self.recipe_index
+
+    def add_to_recipe_index(self, recipes_data):
+        for recipe_data in recipes_data:
+            self.recipe_index.add_recipe(recipe_data['id'], recipe_data['ingredients'], recipe_data['fat_amount'],
+                                         recipe_data['carbs_amount'], recipe_data['protein_amount'])
+
+    def save_recipes(self, recipes_data):
+        try:
+            cursor = self.conn.cursor()
+
+            # Insert or update the recipes in the database
+            cursor.executemany("""
+                INSERT OR REPLACE INTO recipes (id, name, source, ready_in_minutes, servings, calories, fat, carbs,
+                protein, url, ingredients, fat_amount, carbs_amount, protein_amount)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(
+                recipe_data['id'],
+                recipe_data['name'],
+                recipe_data['source'],
+                recipe_data['ready_in_minutes'],
+                recipe_data['servings'],
+                recipe_data['calories'],
+                recipe_data['fat'],
+                recipe_data['carbs'],
+                recipe_data['protein'],
+                recipe_data['url'],
+                ','.join(recipe_data['ingredients']),
+                recipe_data['fat_amount'],
+                recipe_data['carbs_amount'],
+                recipe_data['protein_amount']
+            ) for recipe_data in recipes_data])
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error saving recipes: {e}")
+            return
+
+        # Update similarity index with the new recipes (or keep them until it has been built)
+        if self.get_recipe_index() is None:
+            self.pending_recipes.extend(recipes_data)
+            return
+        self.add_to_recipe_index(recipes_data)
+
+    def load_recipes(self, recipe_ids):
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(f"""
+                SELECT id, name, source, ready_in_minutes, servings, calories, fat, carbs, protein, url
+                FROM recipes
+                WHERE id IN ({','.join('?' * len(recipe_ids))})
+            """, list(recipe_ids))
+            columns = [column[0] for column in cursor.description]
+            recipes = {row[0]: dict(zip(columns, row)) for row in cursor.fetchall()}
+        except sqlite3.Error as e:
+            print(f"Error loading recipes: {e}")
+            return []
+
+        # Keep the order of the given ids
+        return [recipes[recipe_id] for recipe_id in recipe_ids if recipe_id in recipes]
+
     def show_menu_page(self):
         self.stacked_widget.setCurrentWidget(self.menu_page)
 
@@ -248,7 +778,7 @@ class SearchPage(QtWidgets.QWidget):
 
         # Connect buttons
         self.back_button.clicked.connect(self.parent_window.show_menu_page)
-        self.search_button.clicked.connect(self.search_recipes)
+        self.search_button.clicked.connect(lambda: self.search_recipes())
 
         # Label to display search status or errors
         self.status_label = QtWidgets.QLabel()
@@ -274,7 +804,9 @@ class SearchPage(QtWidgets.QWidget):
         # Set layout
         self.setLayout(layout)
 
-    def search_recipes(self):
+    # Search recipes from the search bar and filters, updating the given search history entry if refreshing one
+    # (use_cache=False fetches every recipe's info from the API and overwrites its archived payload)
+    def search_recipes(self, search_id=None, use_cache=True):
         # Update results label to pending
         self.status_label.setText("Searching...")
 
@@ -293,90 +825,154 @@ class SearchPage(QtWidgets.QWidget):
             "x-rapidapi-host": "spoonacular-recipe-food-nutrition-v1.p.rapidapi.com"
         }
 
-        # Add filters to query string and search history entry
+        # Add filters to search history entry
         filters = self.filter_dropdown.selected_items()
-        if filters:
-            querystring['type'] = ','.join(filters)
-            search_data['filters'] = filters
-        else:
-            search_data['filters'] = []
+        search_data['filters'] = filters
 
         # Save search data to database
-        self.save_search_data(search_data)
-
-        # POST recipes search request
-        recipes_response = req.request("GET", recipes_url, headers=headers, params=querystring)
-
-        # If request successful, get and show recipes' info
-        if recipes_response.status_code == 200:
-            # Clean recipes data
-            recipes = recipes_response.json()
-            recipe_ids = [recipe['id'] for recipe in recipes]
-
-            # POST recipes' info request
-            info_bulk_url = "https://spoonacular-recipe-food-nutrition-v1.p.rapidapi.com/recipes/informationBulk"
-            info_bulk_querystring = {"ids": ",".join(map(str, recipe_ids)), "includeNutrition": "true"}
-            info_bulk_response = req.request("GET", info_bulk_url, headers=headers, params=info_bulk_querystring)
-
-            # If request successful, get and show recipes' info
-            if info_bulk_response.status_code == 200:
-                recipes_info = info_bulk_response.json()
-                self.update_results(recipes_info)
-            # Else, show error message
-            else:
-                self.status_label.setText("Error: Unable to retrieve recipes' info.")
-                print(f"Error: {info_bulk_response.status_code} - {info_bulk_response.text}")
+        if search_id is None:
+            search_id = self.save_search_data(search_data)
+
+        # Endpoint handles one dish type at a time, so query each selected type concurrently
+        querystrings = []
+        for dish_type in filters or [None]:
+            type_querystring = dict(querystring)
+            if dish_type:
+                type_querystring['type'] = dish_type
+            querystrings.append(type_querystring)
+
+        with ThreadPoolExecutor(max_workers=len(querystrings)) as executor:
+            type_results = list(executor.map(
+                lambda params: self.request_json(recipes_url, headers, params), querystrings))
+
+        # Merge successful results from all types, noting any types that failed
+        results = [recipes for recipes in type_results if recipes is not None]
+        failed_types = [params.get('type', 'all') for params, recipes in zip(querystrings, type_results)
+                        if recipes is None]
+
+        # If any request successful, get and show recipes' info
+        if results:
+            recipe_ids = merge_recipe_results(results)
+
+            # If no recipes found, show empty results
+            if not recipe_ids:
+                self.update_results([])
+                self.save_search_results(search_id, [] if not failed_types else None)
+                self.status_label.setText("No recipes found." if not failed_types else
+                                          f"No recipes found, but unable to search {', '.join(failed_types)}.")
+                return
+
+            # Get recipes' info from archived payloads where available
+            recipes_info = self.load_cached_recipes_info(recipe_ids) if use_cache else {}
+            missing_ids = [recipe_id for recipe_id in recipe_ids if recipe_id not in recipes_info]
+
+            if missing_ids:
+                # POST recipes' info request (one shared request for all types)
+                info_bulk_url = "https://spoonacular-recipe-food-nutrition-v1.p.rapidapi.com/recipes/informationBulk"
+                info_bulk_querystring = {"ids": ",".join(map(str, missing_ids)), "includeNutrition": "true"}
+                fetched_info = self.request_json(info_bulk_url, headers, info_bulk_querystring)
+
+                # If request failed, show error message
+                if fetched_info is None:
+                    self.status_label.setText("Error: Unable to retrieve recipes' info.")
+                    return
+
+                # Archive the new recipes' info
+                self.save_cached_recipes_info(fetched_info)
+                recipes_info.update({recipe.get('id'): recipe for recipe in fetched_info})
+
+            # Show recipes' info in ranking order
+            recipes_info = [recipes_info[recipe_id] for recipe_id in recipe_ids if recipe_id in recipes_info]
+            self.update_results(recipes_info)
+
+            # Save result ids to search history for instant replay (unless incomplete, so replay searches again)
+            self.save_search_results(search_id, [recipe.get('id') for recipe in recipes_info]
+                                     if not failed_types else None)
+
+            # Warn that results are partial if some types failed
+            if failed_types:
+                self.status_label.setText(f"Warning: Results may be incomplete, unable to search "
+                                          f"{', '.join(failed_types)}.")
         # Else, show error message
         else:
             self.status_label.setText("Error: Unable to retrieve recipes.")
-            print(f"Error: {recipes_response.status_code} - {recipes_response.text}")
+
+    # GET an API endpoint, returning the decoded response or None if the request failed
+    def request_json(self, url, headers, querystring):
+        try:
+            response = req.request("GET", url, headers=headers, params=querystring)
+        except req.RequestException as e:
+            print(f"Error: {e}")
+            return None
+
+        if response.status_code != 200:
+            print(f"Error: {response.status_code} - {response.text}")
+            return None
+        return response.json()
+
+    def load_cached_recipes_info(self, recipe_ids):
+        try:
+            payloads = self.parent_window.payload_store.get_recipes(recipe_ids)
+        except sqlite3.Error as e:
+            print(f"Error loading cached recipes' info: {e}")
+            return {}
+
+        # Decode each payload, treating any that can't be decoded as not cached
+        recipes_info = {}
+        for recipe_id, payload in payloads.items():
+            try:
+                recipes_info[recipe_id] = payload.value
+            except (zlib.error, ValueError) as e:
+                print(f"Error decoding cached info for recipe {recipe_id}: {e}")
+        return recipes_info
+
+    def save_cached_recipes_info(self, recipes_info):
+        try:
+            self.parent_window.payload_store.put_recipes(recipes_info)
+        except sqlite3.Error as e:
+            print(f"Error caching recipes' info: {e}")
 
     # Update results label with recipe cards using recipe info from API
     def update_results(self, recipes_info):
+        # Extract recipe data and store it locally for similarity search
+        recipes_data = [parse_recipe_info(recipe) for recipe in recipes_info]
+        self.parent_window.save_recipes(recipes_data)
+
+        self.show_recipe_cards(recipes_data)
+
+    # Show recipes similar to the given recipe using locally stored recipes
+    def show_similar_recipes(self, recipe_data):
+        recipe_index = self.parent_window.get_recipe_index()
+        if recipe_index is None:
+            self.status_label.setText("Similar recipes are still loading, please try again shortly.")
+            return
+
+        similar_ids = recipe_index.similar(recipe_data['id'], SIMILAR_RECIPES_COUNT)
+        if not similar_ids:
+            self.status_label.setText("No similar recipes found.")
+            return
+
+        self.show_recipe_cards(self.parent_window.load_recipes(similar_ids))
+        self.status_label.setText(f"Recipes similar to {recipe_data['name']}:")
+
+    def show_recipe_cards(self, recipes_data):
         # Clear results label
         self.status_label.setText("")
 
         # Clear existing cards
-        for i in reversed(range(self.scroll_layout.count())):
-            widget = self.scroll_layout.itemAt(i).widget()
-            if widget:
-                widget.deleteLater()
+        clear_cards(self.scroll_layout)
 
         # Add new card for each recipe
-        for recipe in recipes_info:
-            # Extract basic recipe info
-            name = recipe.get('title', 'No title')
-            source = recipe.get('sourceName', 'No source')
-            ready_in_minutes = recipe.get('readyInMinutes', 'Unknown ready time')
-            servings = recipe.get('servings', 'Unknown servings')
-            url = recipe.get('sourceUrl', '#')
-
-            # Extract from nutrition info to get calories, fat, carbs, and protein
-            nutrition_info = {nutrient['name']: nutrient['amount'] for nutrient in
-                              recipe.get('nutrition', {}).get('nutrients', [])}
-            calories = nutrition_info.get('Calories', '')
-            fat = nutrition_info.get('Fat', '')
-            carbs = nutrition_info.get('Carbohydrates', '')
-            protein = nutrition_info.get('Protein', '')
-
-            # Add g to the end of the values if they exist else make them a ?
-            calories = f"{calories}kcal" if calories else '?'
-            fat = f"{fat}g" if fat else '?'
-            carbs = f"{carbs}g" if carbs else '?'
-            protein = f"{protein}g" if protein else '?'
-
-            # Create a dictionary to hold recipe data for adding to favourites if needed
-            recipe_data = {
-                'name': name,
-                'source': source,
-                'ready_in_minutes': ready_in_minutes,
-                'servings': servings,
-                'calories': calories,
-                'fat': fat,
-                'carbs': carbs,
-                'protein': protein,
-                'url': url
-            }
+        for recipe_data in recipes_data:
+            name = recipe_data['name']
+            source = recipe_data['source']
+            ready_in_minutes = recipe_data['ready_in_minutes']
+            servings = recipe_data['servings']
+            calories = recipe_data['calories']
+            fat = recipe_data['fat']
+            carbs = recipe_data['carbs']
+            protein = recipe_data['protein']
+            url = recipe_data['url']
 
             # Create card for recipe
             card = QtWidgets.QWidget()
@@ -393,14 +989,21 @@ class SearchPage(QtWidgets.QWidget):
             link_label.setOpenExternalLinks(True)
             card_layout.addWidget(link_label)
 
-            # Add button to add to favourites
+            # Add buttons to add to favourites and find similar recipes
             add_fav_button = QtWidgets.QPushButton("Add to Favourites")
             add_fav_button.clicked.connect(lambda _, r=recipe_data: self.add_to_favourites(r))
-            card_layout.addWidget(add_fav_button)
+            similar_button = QtWidgets.QPushButton("Similar Recipes")
+            similar_button.clicked.connect(lambda _, r=recipe_data: self.show_similar_recipes(r))
+            button_layout = QtWidgets.QHBoxLayout()
+            button_layout.addWidget(add_fav_button)
+            button_layout.addWidget(similar_button)
+            card_layout.addLayout(button_layout)
 
             # Add card to cards layout
             self.scroll_layout.addWidget(card)
 
+        instrument_reload("search results")
+
     def save_search_data(self, search_data):
         try:
             cursor = self.parent_window.conn.cursor()
@@ -427,13 +1030,46 @@ class SearchPage(QtWidgets.QWidget):
             print(f"Error saving search data: {e}")
             QtWidgets.QMessageBox.critical(self, "Error", "Failed to save search data.",
                                            QtWidgets.QMessageBox.StandardButton.Ok)
-            return
+            return None
         except Exception as e:
             print(f"Unexpected error: {e}")
             QtWidgets.QMessageBox.critical(self, "Error", "An unexpected error occurred.",
                                            QtWidgets.QMessageBox.StandardButton.Ok)
+            return None
+
+        return cursor.lastrowid
+
+    # Store ordered result ids with the search history entry (None clears them so the search runs live on replay)
+    def save_search_results(self, search_id, recipe_ids):
+        if search_id is None:
+            return
+
+        if recipe_ids is None:
+            result_ids = None
+        else:
+            result_ids = ','.join(map(str, recipe_ids)) or NO_RESULTS
+
+        try:
+            cursor = self.parent_window.conn.cursor()
+            cursor.execute("""
+                UPDATE search_history
+                SET result_ids = ?, timestamp = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (result_ids, search_id))
+            self.parent_window.conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error saving search results: {e}")
+
+    # Show stored results of a previous search without calling the API
+    def show_saved_results(self, recipe_ids, timestamp):
+        if not recipe_ids:
+            self.show_recipe_cards([])
+            self.status_label.setText(f"No recipes found (saved results from {timestamp}).")
             return
 
+        self.show_recipe_cards(self.parent_window.load_recipes(recipe_ids))
+        self.status_label.setText(f"Saved results from {timestamp}.")
+
     def add_to_favourites(self, recipe_data):
         try:
             cursor = self.parent_window.conn.cursor()
@@ -520,19 +1156,20 @@ class HistoryPage(QtWidgets.QWidget):
 
     def load_search_history(self):
         # Clear existing cards
-        for i in reversed(range(self.scroll_layout.count())):
-            widget = self.scroll_layout.itemAt(i).widget()
-            if widget:
-                widget.deleteLater()
+        clear_cards(self.scroll_layout)
 
         # Fetch search history from the database
         try:
             cursor = self.parent_window.conn.cursor()
-            cursor.execute("SELECT * FROM search_history ORDER BY timestamp DESC")  # Order by newest
+            cursor.execute("""
+                SELECT id, ingredients, filters, timestamp, result_ids
+                FROM search_history
+                ORDER BY timestamp DESC
+            """)  # Order by newest
             history = cursor.fetchall()
 
             for entry in history:
-                ingredients, filters, timestamp = entry[1:]
+                ingredients, filters, timestamp, result_ids = entry[1:]
 
                 # Create a card for each search history entry
                 entry_widget = QtWidgets.QWidget()
@@ -545,15 +1182,18 @@ class HistoryPage(QtWidgets.QWidget):
 
                 # Add buttons
                 search_button = QtWidgets.QPushButton("Search")
+                refresh_button = QtWidgets.QPushButton("Refresh")
                 delete_button = QtWidgets.QPushButton("Delete")
 
                 # Connect buttons
-                search_button.clicked.connect(lambda _, ing=ingredients, fil=filters: self.retrieve_search(ing, fil))
+                search_button.clicked.connect(lambda _, ing=entry: self.retrieve_search(ing))
+                refresh_button.clicked.connect(lambda _, ing=entry: self.refresh_search(ing))
                 delete_button.clicked.connect(lambda _, ing=entry: self.delete_search(ing))
 
                 # Add buttons to layout (attached to side of history entry)
                 button_layout = QtWidgets.QHBoxLayout()
                 button_layout.addWidget(search_button)
+                button_layout.addWidget(refresh_button)
                 button_layout.addWidget(delete_button)
                 history_layout.addLayout(button_layout)
 
@@ -570,18 +1210,40 @@ class HistoryPage(QtWidgets.QWidget):
                                            QtWidgets.QMessageBox.StandardButton.Ok)
             return
 
-    def retrieve_search(self, ingredients, filters):
-        # Set the search bar text and selected filters
+        instrument_reload("search history")
+
+    def set_search_fields(self, ingredients, filters):
+        # Set the search bar text and selected filters (filters are stored lowercase)
         self.parent_window.search_page.search_bar.setText(ingredients)
         for i in range(self.parent_window.search_page.filter_dropdown.list_widget.count()):
             item = self.parent_window.search_page.filter_dropdown.list_widget.item(i)
-            if item.text() in filters.split(','):
+            if item.text().lower() in filters.split(','):
                 item.setSelected(True)
             else:
                 item.setSelected(False)
 
-        # Execute the search
-        self.parent_window.search_page.search_recipes()
+    def retrieve_search(self, entry):
+        ingredients, filters, timestamp, result_ids = entry[1:]
+        self.set_search_fields(ingredients, filters)
+
+        # Show stored results if available, otherwise execute the search to store them on this entry
+        if result_ids == NO_RESULTS:
+            self.parent_window.search_page.show_saved_results([], timestamp)
+        elif result_ids:
+            recipe_ids = [int(recipe_id) for recipe_id in result_ids.split(',')]
+            self.parent_window.search_page.show_saved_results(recipe_ids, timestamp)
+        else:
+            self.parent_window.search_page.search_recipes(search_id=entry[0])
+
+        # Show search page
+        self.parent_window.show_search_page()
+
+    def refresh_search(self, entry):
+        search_id, ingredients, filters = entry[:3]
+        self.set_search_fields(ingredients, filters)
+
+        # Execute the search to get live results, updating this entry's stored results and archived payloads
+        self.parent_window.search_page.search_recipes(search_id=search_id, use_cache=False)
 
         # Show search page
         self.parent_window.show_search_page()
@@ -645,10 +1307,7 @@ class FavouritesPage(QtWidgets.QWidget):
 
     def load_favourites(self):
         # Clear existing cards
-        for i in reversed(range(self.scroll_layout.count())):
-            widget = self.scroll_layout.itemAt(i).widget()
-            if widget:
-                widget.deleteLater()
+        clear_cards(self.scroll_layout)
 
         # Fetch favourites from the database
         try:
@@ -674,10 +1333,15 @@ class FavouritesPage(QtWidgets.QWidget):
                 link_label.setOpenExternalLinks(True)
                 card_layout.addWidget(link_label)
 
-                # Add button to remove from favourites
+                # Add buttons to remove from favourites and find similar recipes
                 remove_button = QtWidgets.QPushButton("Remove from Favourites")
                 remove_button.clicked.connect(lambda _, r=recipe: self.remove_from_favourites(r))
-                card_layout.addWidget(remove_button)
+                similar_button = QtWidgets.QPushButton("Similar Recipes")
+                similar_button.clicked.connect(lambda _, r=recipe: self.show_similar_recipes(r))
+                button_layout = QtWidgets.QHBoxLayout()
+                button_layout.addWidget(remove_button)
+                button_layout.addWidget(similar_button)
+                card_layout.addLayout(button_layout)
 
                 # Add card to scroll layout
                 self.scroll_layout.addWidget(card)
@@ -692,6 +1356,37 @@ class FavouritesPage(QtWidgets.QWidget):
                                            QtWidgets.QMessageBox.StandardButton.Ok)
             return
 
+        instrument_reload("favourites")
+
+    def show_similar_recipes(self, recipe):
+        try:
+            cursor = self.parent_window.conn.cursor()
+
+            # Favourites don't store the recipe id, so find the stored recipe by name and url
+            cursor.execute("""
+                SELECT id FROM recipes
+                WHERE name = ? AND url = ?
+            """, (
+                recipe[1],
+                recipe[9]
+            ))
+            stored_recipe = cursor.fetchone()
+        except sqlite3.Error as e:
+            print(f"Error finding stored recipe: {e}")
+            QtWidgets.QMessageBox.critical(self, "Error", "Failed to find similar recipes.",
+                                           QtWidgets.QMessageBox.StandardButton.Ok)
+            return
+
+        # If recipe not stored (e.g. favourited before recipes were stored), show error message
+        if stored_recipe is None:
+            QtWidgets.QMessageBox.warning(self, "Error", "Recipe not stored, search for it to find similar recipes.",
+                                          QtWidgets.QMessageBox.StandardButton.Ok)
+            return
+
+        # Show similar recipes on search page
+        self.parent_window.search_page.show_similar_recipes({'id': stored_recipe[0], 'name': recipe[1]})
+        self.parent_window.show_search_page()
+
     def remove_from_favourites(self, recipe):
         try:
             cursor = self.parent_window.conn.cursor()
@@ -736,16 +1431,19 @@ class SettingsPage(QtWidgets.QWidget):
 
         # Create buttons
         self.save_button = QtWidgets.QPushButton("Save")
+        self.compact_button = QtWidgets.QPushButton("Compact Database")
         self.back_button = QtWidgets.QPushButton("Back")
 
         # Connect buttons
         self.save_button.clicked.connect(self.save_settings)
+        self.compact_button.clicked.connect(self.compact_database)
         self.back_button.clicked.connect(self.parent_window.show_menu_page)
 
         # Add widgets to layout
         layout.addWidget(self.api_key_label)
         layout.addWidget(self.api_key_input)
         layout.addWidget(self.save_button)
+        layout.addWidget(self.compact_button)
         layout.addWidget(self.back_button)
 
         # Set layout
@@ -758,6 +1456,18 @@ class SettingsPage(QtWidgets.QWidget):
         QtWidgets.QMessageBox.information(self, "Settings", "API Key saved successfully.",
                                           QtWidgets.QMessageBox.StandardButton.Ok)
 
+    def compact_database(self):
+        try:
+            size_before, size_after = self.parent_window.payload_store.compact()
+        except (sqlite3.Error, zlib.error) as e:
+            print(f"Error compacting database: {e}")
+            QtWidgets.QMessageBox.critical(self, "Error", "Failed to compact database.",
+                                           QtWidgets.QMessageBox.StandardButton.Ok)
+            return
+
+        QtWidgets.QMessageBox.information(self, "Settings", f"Database compacted from {size_before // 1024}KB to "
+                                          f"{size_after // 1024}KB.", QtWidgets.QMessageBox.StandardButton.Ok)
+
 
 if __name__ == '__main__':
     # Create the Qt Application